@@ -0,0 +1,7 @@
+# Session key holding the number of items in the visitor's cart
+CART_ITEMS_SESSION_KEY = 'cart_items'
+
+
+def cart_summary(request):
+    """Cart badge count, kept in the session by the cart views"""
+    return {'cart_item_count': request.session.get(CART_ITEMS_SESSION_KEY, 0)}
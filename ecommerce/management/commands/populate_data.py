@@ -1,11 +1,15 @@
 import random
 from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from django.db import transaction
 from django.utils.text import slugify
 from ecommerce.models import Category, Product
+from ecommerce.signals import CATEGORIES_KEY, HOME_FEATURED_KEY, PRODUCT_COUNT_KEY
 
 class Command(BaseCommand):
     help = 'Populate the database with sample e-commerce data'
 
+    @transaction.atomic
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting to populate database with sample data...'))
         
@@ -37,20 +41,15 @@ class Command(BaseCommand):
             }
         ]
 
-        categories = []
-        for cat_data in categories_data:
-            category, created = Category.objects.get_or_create(
+        # Rows whose slug already exists are skipped by the database
+        new_categories = [
+            Category(
                 name=cat_data['name'],
-                defaults={
-                    'slug': slugify(cat_data['name']),
-                    'description': cat_data['description']
-                }
+                slug=slugify(cat_data['name']),
+                description=cat_data['description']
             )
-            categories.append(category)
-            if created:
-                self.stdout.write(f'Created category: {category.name}')
-            else:
-                self.stdout.write(f'Category already exists: {category.name}')
+            for cat_data in categories_data
+        ]
 
         # Create Products
         products_data = [
@@ -195,31 +194,58 @@ class Command(BaseCommand):
             }
         ]
 
+        categories_before = Category.objects.count()
+        Category.objects.bulk_create(new_categories, ignore_conflicts=True)
+        categories_created = Category.objects.count() - categories_before
+
+        # ignore_conflicts leaves primary keys unset, so resolve the
+        # saved categories with one query
+        categories = {
+            category.slug: category
+            for category in Category.objects.filter(
+                slug__in=[category.slug for category in new_categories]
+            )
+        }
+
+        new_products = []
         for product_data in products_data:
-            # Find the category
-            try:
-                category = Category.objects.get(name=product_data['category'])
-            except Category.DoesNotExist:
+            category = categories.get(slugify(product_data['category']))
+            if category is None:
                 self.stdout.write(self.style.ERROR(f'Category {product_data["category"]} not found'))
                 continue
 
-            product, created = Product.objects.get_or_create(
+            new_products.append(Product(
                 name=product_data['name'],
-                defaults={
-                    'slug': slugify(product_data['name']),
-                    'description': product_data['description'],
-                    'price': product_data['price'],
-                    'category': category,
-                    'stock': product_data['stock'],
-                    'image_url': product_data['image_url'],
-                    'is_active': True
-                }
-            )
-            
-            if created:
-                self.stdout.write(f'Created product: {product.name}')
-            else:
-                self.stdout.write(f'Product already exists: {product.name}')
+                slug=slugify(product_data['name']),
+                description=product_data['description'],
+                price=product_data['price'],
+                category=category,
+                stock=product_data['stock'],
+                image_url=product_data['image_url'],
+                is_active=True
+            ))
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Prepared product: {product_data["name"]}')
+
+        products_before = Product.objects.count()
+        Product.objects.bulk_create(new_products, batch_size=500, ignore_conflicts=True)
+        products_created = Product.objects.count() - products_before
+
+        self.stdout.write(
+            f'Created {categories_created} categories '
+            f'({len(new_categories) - categories_created} already existed)'
+        )
+        self.stdout.write(
+            f'Created {products_created} products '
+            f'({len(new_products) - products_created} already existed)'
+        )
+
+        # bulk_create sends no post_save signals, so drop the cached catalog
+        # blocks here once the new rows are committed
+        stale_keys = [CATEGORIES_KEY, HOME_FEATURED_KEY, PRODUCT_COUNT_KEY.format('all')] + [
+            PRODUCT_COUNT_KEY.format(slug) for slug in Category.objects.values_list('slug', flat=True)
+        ]
+        transaction.on_commit(lambda: cache.delete_many(stale_keys))
 
         # Summary
         total_categories = Category.objects.count()
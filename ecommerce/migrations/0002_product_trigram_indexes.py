@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# Product search filters with icontains, which PostgreSQL runs as
+# UPPER(column::text) LIKE UPPER('%term%'). Trigram GIN indexes on those
+# exact expressions let the planner answer the filter from the index.
+# Other databases have no pg_trgm, so the migration is a no-op there.
+
+TRIGRAM_INDEXES = {
+    'prod_name_trgm': 'name',
+    'prod_description_trgm': 'description',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON ecommerce_product '
+            f'USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -29,6 +29,12 @@ class Product(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Active-product listings in each of their sort orders
+            models.Index(fields=['is_active', 'price'], name='prod_active_price_idx'),
+            models.Index(fields=['is_active', 'name'], name='prod_active_name_idx'),
+            models.Index(fields=['is_active', '-created_at'], name='prod_active_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -1,115 +1,181 @@
 import numpy as np
+from scipy import sparse
+
+# Recommendation scores don't need double precision; float32 halves memory
+# traffic and doubles the SIMD width in BLAS
+DTYPE = np.float32
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is an optional accelerator for sparse inputs
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_csr(indptr, indices, data, n_cols):
+        """
+        Cosine similarity between the rows of a CSR matrix, walking only
+        the stored non-zeros of each pair of rows
+        """
+        n = indptr.shape[0] - 1
+        norms = np.zeros(n, dtype=np.float64)
+        for i in range(n):
+            acc = 0.0
+            for p in range(indptr[i], indptr[i + 1]):
+                acc += data[p] * data[p]
+            norms[i] = np.sqrt(acc)
+
+        similarity = np.zeros((n, n), dtype=np.float32)
+        for i in prange(n):
+            similarity[i, i] = 1.0
+            if norms[i] == 0.0:
+                continue
+            # Scatter row i into a dense scratch vector
+            scratch = np.zeros(n_cols, dtype=np.float32)
+            for p in range(indptr[i], indptr[i + 1]):
+                scratch[indices[p]] = data[p]
+            for j in range(i + 1, n):
+                if norms[j] == 0.0:
+                    continue
+                dot_product = 0.0
+                for p in range(indptr[j], indptr[j + 1]):
+                    dot_product += scratch[indices[p]] * data[p]
+                value = dot_product / (norms[i] * norms[j])
+                similarity[i, j] = value
+                similarity[j, i] = value
+        return similarity
+
+def _normalize_gram(gram, norms):
+    """
+    Turn a Gram matrix into cosine similarities in place, treating zero
+    norms as zero similarity and keeping the diagonal at 1.0
+    """
+    # Scaling rows and columns by the inverse norms avoids allocating an
+    # n x n outer product of norms next to the Gram matrix
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    gram *= inverse_norms[:, None]
+    gram *= inverse_norms[None, :]
+    np.fill_diagonal(gram, 1.0)
+    return gram
+
+def _sparse_row_similarity(matrix):
+    """
+    Cosine similarity between the rows of a sparse matrix
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=DTYPE)
+    if njit is not None:
+        return _cosine_csr(matrix.indptr, matrix.indices, matrix.data, matrix.shape[1])
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=DTYPE).ravel())
+    return _normalize_gram((matrix @ matrix.T).toarray(), norms)
+
+def _dense_row(matrix, idx):
+    """
+    Return row idx of a dense or sparse matrix as a 1-D array
+    """
+    if sparse.issparse(matrix):
+        return matrix.getrow(idx).toarray().ravel()
+    return matrix[idx, :]
+
+def _dense_col(matrix, idx):
+    """
+    Return column idx of a dense or sparse matrix as a 1-D array
+    """
+    if sparse.issparse(matrix):
+        return matrix.getcol(idx).toarray().ravel()
+    return matrix[:, idx]
 
 def compute_cosine_similarity_matrix(matrix):
     """
     Compute cosine similarity matrix for user-item interactions
-    Pure Python implementation
+    Vectorized NumPy implementation (single GEMM); sparse inputs use
+    the Numba CSR kernel when available
     """
-    n_users = matrix.shape[0]
-    similarity_matrix = np.zeros((n_users, n_users), dtype=np.float64)
-    
-    # Precompute norms for efficiency
-    norms = np.zeros(n_users, dtype=np.float64)
-    for i in range(n_users):
-        norms[i] = np.sqrt(np.sum(matrix[i, :] ** 2))
-    
-    # Compute similarity matrix
-    for i in range(n_users):
-        for j in range(i, n_users):
-            if i == j:
-                similarity_matrix[i, j] = 1.0
-            else:
-                dot_product = np.dot(matrix[i, :], matrix[j, :])
-                if norms[i] > 0.0 and norms[j] > 0.0:
-                    similarity = dot_product / (norms[i] * norms[j])
-                    similarity_matrix[i, j] = similarity
-                    similarity_matrix[j, i] = similarity
-                else:
-                    similarity_matrix[i, j] = 0.0
-                    similarity_matrix[j, i] = 0.0
-    
-    return similarity_matrix
+    if sparse.issparse(matrix):
+        return _sparse_row_similarity(matrix)
+    matrix = np.asarray(matrix, dtype=DTYPE)
+    norms = np.sqrt((matrix * matrix).sum(axis=1))
+    return _normalize_gram(matrix @ matrix.T, norms)
 
 def compute_item_similarity_matrix(matrix):
     """
     Compute item-to-item similarity matrix
-    Pure Python implementation
+    Vectorized NumPy implementation (single GEMM); sparse inputs use
+    the Numba CSR kernel when available
     """
-    n_users, n_items = matrix.shape
-    item_similarity = np.zeros((n_items, n_items), dtype=np.float64)
-    
-    # Precompute item norms
-    item_norms = np.zeros(n_items, dtype=np.float64)
-    for i in range(n_items):
-        item_norms[i] = np.sqrt(np.sum(matrix[:, i] ** 2))
-    
-    # Compute item similarity matrix
-    for i in range(n_items):
-        for j in range(i, n_items):
-            if i == j:
-                item_similarity[i, j] = 1.0
-            else:
-                dot_product = np.dot(matrix[:, i], matrix[:, j])
-                if item_norms[i] > 0.0 and item_norms[j] > 0.0:
-                    similarity = dot_product / (item_norms[i] * item_norms[j])
-                    item_similarity[i, j] = similarity
-                    item_similarity[j, i] = similarity
-                else:
-                    item_similarity[i, j] = 0.0
-                    item_similarity[j, i] = 0.0
-    
-    return item_similarity
+    if sparse.issparse(matrix):
+        return _sparse_row_similarity(matrix.T)
+    matrix = np.asarray(matrix, dtype=DTYPE)
+    item_norms = np.sqrt((matrix * matrix).sum(axis=0))
+    return _normalize_gram(matrix.T @ matrix, item_norms)
 
 def fast_predict_rating(user_item_matrix, similarity_matrix, user_idx, item_idx, k=10):
     """
     Fast prediction of user rating for an item using collaborative filtering
-    Pure Python implementation
+    Vectorized NumPy implementation (argpartition top-k)
     """
     similarities = similarity_matrix[user_idx, :]
-    ratings = user_item_matrix[:, item_idx]
+    ratings = _dense_col(user_item_matrix, item_idx)
     
     # Find k most similar users who have rated this item
-    similar_users = []
-    for i in range(len(similarities)):
-        if i != user_idx and ratings[i] > 0:
-            similar_users.append((similarities[i], i, ratings[i]))
-    
-    # Sort by similarity and take top k
-    similar_users.sort(reverse=True)
-    similar_users = similar_users[:k]
-    
-    if not similar_users:
+    valid = ratings > 0
+    valid[user_idx] = False
+    k_eff = min(k, int(valid.sum()))
+    if k_eff == 0:
         return 0.0
     
-    # Compute weighted average
-    weighted_sum = 0.0
-    similarity_sum = 0.0
-    
-    for sim, user_id, rating in similar_users:
-        if sim > 0:
-            weighted_sum += sim * rating
-            similarity_sum += abs(sim)
+    candidate_sims = np.where(valid, similarities, -np.inf)
+    # Everyone more similar than the k-th best neighbour, then the users
+    # tied with it from the highest index down, as a descending sort picks
+    kth_sim = candidate_sims[np.argpartition(-candidate_sims, k_eff - 1)[k_eff - 1]]
+    above = np.flatnonzero(candidate_sims > kth_sim)
+    tied = np.flatnonzero(candidate_sims == kth_sim)[::-1][:k_eff - len(above)]
+    top = np.concatenate((above, tied))
+    top_sims = candidate_sims[top]
+    top_ratings = ratings[top]
     
+    # Compute weighted average over the positively similar neighbours
+    positive = top_sims > 0
+    similarity_sum = np.abs(top_sims[positive]).sum()
     if similarity_sum > 0:
-        return weighted_sum / similarity_sum
+        return float((top_sims[positive] * top_ratings[positive]).sum() / similarity_sum)
     else:
         return 0.0
 
-def compute_user_recommendations(user_item_matrix, similarity_matrix, user_idx, n_recommendations=5):
+def compute_user_recommendations(user_item_matrix, similarity_matrix, user_idx, n_recommendations=5, k=10):
     """
     Compute top N recommendations for a user
-    Pure Python implementation
+    Scores every item at once with the same k-nearest-raters rule as
+    fast_predict_rating
     """
-    n_items = user_item_matrix.shape[1]
-    recommendations = []
+    similarities = np.asarray(similarity_matrix[user_idx, :], dtype=DTYPE)
+    n_users, n_items = user_item_matrix.shape
+    
+    # Rank neighbours once by decreasing similarity; each item column then
+    # lists its raters in that order
+    order = np.lexsort((-np.arange(n_users), -similarities))
+    ratings = sparse.csr_matrix(user_item_matrix, dtype=DTYPE)[order]
+    ratings.data[ratings.data < 0] = 0.0
+    ratings.eliminate_zeros()
+    ratings = ratings.tocsc()
+    ratings.sort_indices()
+    
+    # Keep the k most similar raters of every item, then average the
+    # ratings of the positively similar ones
+    raters_per_item = np.diff(ratings.indptr)
+    rank = np.arange(ratings.nnz) - np.repeat(ratings.indptr[:-1], raters_per_item)
+    item_of = np.repeat(np.arange(n_items), raters_per_item)
+    neighbour_sims = similarities[order][ratings.indices]
+    keep = (rank < k) & (neighbour_sims > 0)
+    weighted_sum = np.bincount(item_of[keep], weights=neighbour_sims[keep] * ratings.data[keep],
+                               minlength=n_items)
+    similarity_sum = np.bincount(item_of[keep], weights=neighbour_sims[keep], minlength=n_items)
+    predicted = np.zeros(n_items, dtype=DTYPE)
+    np.divide(weighted_sum, similarity_sum, out=predicted, where=similarity_sum > 0)
     
-    for i in range(n_items):
-        # Only recommend items the user hasn't interacted with
-        if user_item_matrix[user_idx, i] == 0:
-            predicted_rating = fast_predict_rating(user_item_matrix, similarity_matrix, user_idx, i)
-            if predicted_rating > 0:
-                recommendations.append((i, predicted_rating))
+    # Only recommend items the user hasn't interacted with
+    predicted[np.asarray(_dense_row(user_item_matrix, user_idx)) != 0] = 0.0
+    candidates = np.flatnonzero(predicted > 0)
     
-    # Sort by predicted rating and return top N
-    recommendations.sort(key=lambda x: x[1], reverse=True)
-    return recommendations[:n_recommendations]
\ No newline at end of file
+    # Sort by predicted rating and return top N, with ties going to the lower item index
+    candidates = candidates[np.lexsort((candidates, -predicted[candidates]))][:n_recommendations]
+    return [(int(i), float(predicted[i])) for i in candidates]
@@ -2,18 +2,112 @@
 # cython: boundscheck=False
 # cython: wraparound=False
 
+import os
+
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange, threadid
 from libc.math cimport sqrt
+from scipy import sparse
+
+# Define numpy array types for efficiency; recommendation scores don't
+# need double precision
+DTYPE = np.float32
+ctypedef np.float32_t DTYPE_t
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _cosine_csr(matrix):
+    """
+    Cosine similarity between the rows of a CSR matrix, walking only
+    the stored non-zeros of each pair of rows. Rows are spread over
+    OpenMP threads, each with its own scratch vector
+    """
+    cdef Py_ssize_t[:] indptr = np.asarray(matrix.indptr, dtype=np.intp)
+    cdef Py_ssize_t[:] indices = np.asarray(matrix.indices, dtype=np.intp)
+    cdef DTYPE_t[:] data = np.asarray(matrix.data, dtype=DTYPE)
+    cdef Py_ssize_t n = matrix.shape[0]
+    cdef int n_threads = os.cpu_count() or 1
+    similarity = np.zeros((n, n), dtype=DTYPE)
+    cdef DTYPE_t[:, ::1] sim = similarity
+    cdef DTYPE_t[::1] norms = np.zeros(n, dtype=DTYPE)
+    cdef DTYPE_t[:, ::1] scratch = np.zeros((n_threads, matrix.shape[1]), dtype=DTYPE)
+    
+    cdef Py_ssize_t i, j, p
+    cdef int t
+    cdef double dot_product, norm_i, similarity_ij
+    
+    for i in range(n):
+        norm_i = 0.0
+        for p in range(indptr[i], indptr[i + 1]):
+            norm_i += data[p] * data[p]
+        norms[i] = sqrt(norm_i)
+    
+    # Row i fills sim[i, j] and sim[j, i] for j > i only, so threads never
+    # write the same cell; later rows are shorter, hence dynamic scheduling
+    for i in prange(n, nogil=True, schedule='dynamic', num_threads=n_threads):
+        t = threadid()
+        sim[i, i] = 1.0
+        if norms[i] == 0.0:
+            continue
+        
+        # Scatter row i into this thread's scratch vector
+        for p in range(indptr[i], indptr[i + 1]):
+            scratch[t, indices[p]] = data[p]
+        
+        for j in range(i + 1, n):
+            if norms[j] == 0.0:
+                continue
+            dot_product = 0.0
+            for p in range(indptr[j], indptr[j + 1]):
+                dot_product = dot_product + scratch[t, indices[p]] * data[p]
+            similarity_ij = dot_product / (norms[i] * norms[j])
+            sim[i, j] = similarity_ij
+            sim[j, i] = similarity_ij
+        
+        for p in range(indptr[i], indptr[i + 1]):
+            scratch[t, indices[p]] = 0.0
+    
+    return similarity
+
+def _dense_row(matrix, idx):
+    """
+    Return row idx of a dense or sparse matrix as a 1-D array
+    """
+    if sparse.issparse(matrix):
+        return matrix.getrow(idx).toarray().ravel()
+    return matrix[idx, :]
+
+def _dense_col(matrix, idx):
+    """
+    Return column idx of a dense or sparse matrix as a 1-D array
+    """
+    if sparse.issparse(matrix):
+        return matrix.getcol(idx).toarray().ravel()
+    return matrix[:, idx]
 
-# Define numpy array types for efficiency
-DTYPE = np.float64
-ctypedef np.float64_t DTYPE_t
+def compute_cosine_similarity_matrix(matrix):
+    """
+    Compute cosine similarity matrix for user-item interactions
+    Sparse inputs are handled by the CSR kernel
+    """
+    if sparse.issparse(matrix):
+        return _cosine_csr(sparse.csr_matrix(matrix, dtype=DTYPE))
+    return _cosine_dense(np.asarray(matrix, dtype=DTYPE))
+
+def compute_item_similarity_matrix(matrix):
+    """
+    Compute item-to-item similarity matrix
+    Sparse inputs are handled by the CSR kernel
+    """
+    if sparse.issparse(matrix):
+        return _cosine_csr(sparse.csr_matrix(matrix.T, dtype=DTYPE))
+    return _item_similarity_dense(np.asarray(matrix, dtype=DTYPE))
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def compute_cosine_similarity_matrix(np.ndarray[DTYPE_t, ndim=2] matrix):
+def _cosine_dense(np.ndarray[DTYPE_t, ndim=2] matrix):
     """
     Compute cosine similarity matrix for user-item interactions
     Optimized with Cython for performance
@@ -55,7 +149,7 @@ def compute_cosine_similarity_matrix(np.ndarray[DTYPE_t, ndim=2] matrix):
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def compute_item_similarity_matrix(np.ndarray[DTYPE_t, ndim=2] matrix):
+def _item_similarity_dense(np.ndarray[DTYPE_t, ndim=2] matrix):
     """
     Compute item-to-item similarity matrix
     Optimized with Cython for performance
@@ -97,39 +191,40 @@ def compute_item_similarity_matrix(np.ndarray[DTYPE_t, ndim=2] matrix):
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def fast_predict_rating(np.ndarray[DTYPE_t, ndim=2] user_item_matrix,
+def fast_predict_rating(user_item_matrix,
                        np.ndarray[DTYPE_t, ndim=2] similarity_matrix,
                        int user_idx, int item_idx, int k=10):
     """
     Fast prediction of user rating for an item using collaborative filtering
     """
-    cdef int n_users = user_item_matrix.shape[0]
     cdef np.ndarray[DTYPE_t, ndim=1] similarities = similarity_matrix[user_idx, :]
-    cdef np.ndarray[DTYPE_t, ndim=1] ratings = user_item_matrix[:, item_idx]
+    cdef np.ndarray[DTYPE_t, ndim=1] ratings = np.asarray(_dense_col(user_item_matrix, item_idx), dtype=DTYPE)
     
     # Find k most similar users who have rated this item
-    cdef list similar_users = []
-    cdef int i
-    cdef double sim, rating
-    
-    for i in range(n_users):
-        if i != user_idx and ratings[i] > 0:
-            similar_users.append((similarities[i], i, ratings[i]))
-    
-    # Sort by similarity and take top k
-    similar_users.sort(reverse=True)
-    similar_users = similar_users[:k]
-    
-    if not similar_users:
+    valid = ratings > 0
+    valid[user_idx] = False
+    cdef int k_eff = min(k, int(valid.sum()))
+    if k_eff == 0:
         return 0.0
     
-    # Compute weighted average
+    cdef np.ndarray[DTYPE_t, ndim=1] candidate_sims = np.where(valid, similarities, -np.inf).astype(DTYPE)
+    # Everyone more similar than the k-th best neighbour, then the users
+    # tied with it from the highest index down, as a descending sort picks
+    cdef DTYPE_t kth_sim = candidate_sims[np.argpartition(-candidate_sims, k_eff - 1)[k_eff - 1]]
+    above = np.flatnonzero(candidate_sims > kth_sim)
+    tied = np.flatnonzero(candidate_sims == kth_sim)[::-1][:k_eff - len(above)]
+    cdef np.ndarray[np.intp_t, ndim=1] top = np.concatenate((above, tied))
+    
+    # Compute weighted average over the positively similar neighbours
     cdef double weighted_sum = 0.0
     cdef double similarity_sum = 0.0
+    cdef double sim
+    cdef Py_ssize_t t
     
-    for sim, user_id, rating in similar_users:
+    for t in range(k_eff):
+        sim = candidate_sims[top[t]]
         if sim > 0:
-            weighted_sum += sim * rating
+            weighted_sum += sim * ratings[top[t]]
             similarity_sum += abs(sim)
     
     if similarity_sum > 0:
@@ -137,26 +232,43 @@ def fast_predict_rating(np.ndarray[DTYPE_t, ndim=2] user_item_matrix,
     else:
         return 0.0
 
-@cython.boundscheck(False) 
-@cython.wraparound(False)
-def compute_user_recommendations(np.ndarray[DTYPE_t, ndim=2] user_item_matrix,
+def compute_user_recommendations(user_item_matrix,
                                 np.ndarray[DTYPE_t, ndim=2] similarity_matrix,
-                                int user_idx, int n_recommendations=5):
+                                int user_idx, int n_recommendations=5, int k=10):
     """
     Compute top N recommendations for a user
+    Scores every item at once with the same k-nearest-raters rule as
+    fast_predict_rating
     """
-    cdef int n_items = user_item_matrix.shape[1]
-    cdef list recommendations = []
-    cdef int i
-    cdef double predicted_rating
+    similarities = np.asarray(similarity_matrix[user_idx, :], dtype=DTYPE)
+    n_users, n_items = user_item_matrix.shape
     
-    for i in range(n_items):
-        # Only recommend items the user hasn't interacted with
-        if user_item_matrix[user_idx, i] == 0:
-            predicted_rating = fast_predict_rating(user_item_matrix, similarity_matrix, user_idx, i)
-            if predicted_rating > 0:
-                recommendations.append((i, predicted_rating))
-    
-    # Sort by predicted rating and return top N
-    recommendations.sort(key=lambda x: x[1], reverse=True)
-    return recommendations[:n_recommendations]
\ No newline at end of file
+    # Rank neighbours once by decreasing similarity; each item column then
+    # lists its raters in that order
+    order = np.lexsort((-np.arange(n_users), -similarities))
+    ratings = sparse.csr_matrix(user_item_matrix, dtype=DTYPE)[order]
+    ratings.data[ratings.data < 0] = 0.0
+    ratings.eliminate_zeros()
+    ratings = ratings.tocsc()
+    ratings.sort_indices()
+    
+    # Keep the k most similar raters of every item, then average the
+    # ratings of the positively similar ones
+    raters_per_item = np.diff(ratings.indptr)
+    rank = np.arange(ratings.nnz) - np.repeat(ratings.indptr[:-1], raters_per_item)
+    item_of = np.repeat(np.arange(n_items), raters_per_item)
+    neighbour_sims = similarities[order][ratings.indices]
+    keep = (rank < k) & (neighbour_sims > 0)
+    weighted_sum = np.bincount(item_of[keep], weights=neighbour_sims[keep] * ratings.data[keep],
+                               minlength=n_items)
+    similarity_sum = np.bincount(item_of[keep], weights=neighbour_sims[keep], minlength=n_items)
+    predicted = np.zeros(n_items, dtype=DTYPE)
+    np.divide(weighted_sum, similarity_sum, out=predicted, where=similarity_sum > 0)
+    
+    # Only recommend items the user hasn't interacted with
+    predicted[np.asarray(_dense_row(user_item_matrix, user_idx)) != 0] = 0.0
+    candidates = np.flatnonzero(predicted > 0)
+    
+    # Sort by predicted rating and return top N, with ties going to the lower item index
+    candidates = candidates[np.lexsort((candidates, -predicted[candidates]))][:n_recommendations]
+    return [(int(i), float(predicted[i])) for i in candidates]
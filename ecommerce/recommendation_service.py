@@ -1,6 +1,15 @@
+import hashlib
+import threading
+from functools import partial
+from dataclasses import dataclass, replace
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
-from django.db import models
+from scipy import sparse
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models, transaction
 from django.utils import timezone
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
@@ -17,6 +26,49 @@ from .recommendation_engine import (
 
 logger = logging.getLogger(__name__)
 
+# Scale used when item similarities are stored as int8
+SIMILARITY_SCALE = 127
+
+# Weights of the interaction types in the user-item matrix
+INTERACTION_WEIGHTS = {
+    'view': 1.0,
+    'like': 3.0,
+    'dislike': -2.0,
+    'purchase': 5.0
+}
+
+# Cache key of the running UserInteraction count that paces retraining
+INTERACTION_COUNT_KEY = 'ui_count'
+
+# Scored recommendations per session are cached this long; a session's own
+# new interactions clear its entry right away
+USER_RECOMMENDATIONS_TIMEOUT = 300
+
+# Seconds queued interactions wait so that a burst is written together
+INTERACTION_FLUSH_INTERVAL = 0.5
+
+# Product columns rendered by the recommendation cards
+RECOMMENDATION_FIELDS = ('id', 'name', 'slug', 'description', 'price', 'image_url')
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """
+    Trained model state, published as a whole so that readers never see
+    matrices and mappings from two different training runs
+    """
+    user_item_matrix: sparse.csr_matrix
+    user_sim: np.ndarray
+    item_sim: np.ndarray
+    user_mapping: dict
+    item_mapping: dict
+    reverse_user_mapping: dict
+    reverse_item_mapping: dict
+    user_norms: np.ndarray
+    item_norms: np.ndarray
+    content_features: sparse.csr_matrix = None
+
+
 class RecommendationService:
     """
     Machine Learning recommendation service using collaborative filtering
@@ -24,68 +76,70 @@ class RecommendationService:
     """
     
     def __init__(self):
-        self.user_item_matrix = None
-        self.user_similarity_matrix = None
-        self.item_similarity_matrix = None
-        self.user_mapping = {}
-        self.item_mapping = {}
-        self.reverse_user_mapping = {}
-        self.reverse_item_mapping = {}
-        self.content_features = None
-        self.is_trained = False
+        # Replaced wholesale by train_model; request threads read it without
+        # locking. Writers serialize on _update_lock
+        self._snapshot = None
+        self._update_lock = threading.Lock()
+        self._retrain_lock = threading.Lock()
+        self._retrain_running = False
+        self._retrain_pending = False
+        self._queue_lock = threading.Lock()
+        self._interaction_queue = []
+        self._flush_scheduled = False
+    
+    @property
+    def is_trained(self):
+        return self._snapshot is not None
     
     def prepare_interaction_data(self):
         """
-        Prepare user-item interaction data from the database
+        Prepare user-item interaction data from the database. Returns the
+        user-item matrix with the session and product index mappings
         """
         try:
-            # Get all interactions with weights
-            interactions = UserInteraction.objects.all()
+            # Get all interactions as plain tuples of the needed columns; no
+            # model instances, related lookups or ORDER BY
+            interactions = list(
+                UserInteraction.objects.order_by().values_list(
+                    'session_key', 'product_id', 'interaction_type'
+                )
+            )
             
-            if not interactions.exists():
+            if not interactions:
                 logger.warning("No user interactions found")
                 return None
             
             # Create interaction matrix with weighted scores
-            interaction_data = []
-            for interaction in interactions:
-                weight = self._get_interaction_weight(interaction.interaction_type)
-                interaction_data.append({
-                    'session_key': interaction.session_key,
-                    'product_id': interaction.product.id,
-                    'weight': weight,
-                    'timestamp': interaction.timestamp
-                })
-            
-            if not interaction_data:
-                return None
-            
-            df = pd.DataFrame(interaction_data)
+            session_keys, product_ids, interaction_types = zip(*interactions)
+            # Look up each distinct interaction type once and gather the
+            # per-row weights from the resulting table
+            type_codes, type_uniques = pd.factorize(np.array(interaction_types, dtype=object))
+            weight_table = np.array(
+                [self._get_interaction_weight(t) for t in type_uniques], dtype=np.float32
+            )
+            weights = weight_table[type_codes]
             
-            # Group by session_key and product_id to aggregate weights
-            user_item_df = df.groupby(['session_key', 'product_id'])['weight'].sum().reset_index()
+            # Integer-code both keys directly instead of grouping on them
+            user_idx, unique_users = pd.factorize(np.array(session_keys, dtype=object), sort=True)
+            item_idx, unique_items = pd.factorize(np.array(product_ids), sort=True)
             
             # Create mappings
-            unique_users = user_item_df['session_key'].unique()
-            unique_items = user_item_df['product_id'].unique()
-            
-            self.user_mapping = {user: idx for idx, user in enumerate(unique_users)}
-            self.item_mapping = {item: idx for idx, item in enumerate(unique_items)}
-            self.reverse_user_mapping = {idx: user for user, idx in self.user_mapping.items()}
-            self.reverse_item_mapping = {idx: item for item, idx in self.item_mapping.items()}
+            user_mapping = {user: idx for idx, user in enumerate(unique_users.tolist())}
+            item_mapping = {item: idx for idx, item in enumerate(unique_items.tolist())}
             
             # Create user-item matrix
             n_users = len(unique_users)
             n_items = len(unique_items)
             
-            user_item_matrix = np.zeros((n_users, n_items), dtype=np.float64)
-            
-            for _, row in user_item_df.iterrows():
-                user_idx = self.user_mapping[row['session_key']]
-                item_idx = self.item_mapping[row['product_id']]
-                user_item_matrix[user_idx, item_idx] = row['weight']
+            # Most sessions touch only a handful of products, so build the
+            # matrix sparse; converting COO to CSR sums the weights of
+            # repeated (session, product) pairs
+            user_item_matrix = sparse.coo_matrix(
+                (weights, (user_idx, item_idx)), shape=(n_users, n_items)
+            ).tocsr()
+            user_item_matrix.eliminate_zeros()
             
-            return user_item_matrix
+            return user_item_matrix, user_mapping, item_mapping
             
         except Exception as e:
             logger.error(f"Error preparing interaction data: {str(e)}")
@@ -95,13 +149,7 @@ class RecommendationService:
         """
         Assign weights to different interaction types
         """
-        weights = {
-            'view': 1.0,
-            'like': 3.0,
-            'dislike': -2.0,
-            'purchase': 5.0
-        }
-        return weights.get(interaction_type, 1.0)
+        return INTERACTION_WEIGHTS.get(interaction_type, 1.0)
     
     def prepare_content_features(self):
         """
@@ -110,23 +158,44 @@ class RecommendationService:
         try:
             products = Product.objects.filter(is_active=True)
             
+            # The catalog changes rarely, so reuse features fitted on the
+            # same set of product rows
+            signature = hashlib.md5(
+                repr(list(products.values_list('id', 'updated_at', 'category__name'))).encode()
+            ).hexdigest()
+            cache_path = Path(settings.RECOMMENDATION_CACHE_DIR) / f'content_csr_{signature}.npz'
+            if cache_path.exists():
+                return sparse.load_npz(cache_path)
+            
             if not products.exists():
                 return None
             
-            # Create content features from product descriptions
-            descriptions = [f"{p.name} {p.description} {p.category.name}" for p in products]
+            # Stream the needed columns in one joined query; prices are
+            # collected while TF-IDF consumes the descriptions
+            rows = products.values_list(
+                'name', 'description', 'category__name', 'price'
+            ).iterator(chunk_size=1000)
+            prices = []
             
-            # Use TF-IDF for text features
+            def descriptions():
+                for name, description, category_name, price in rows:
+                    prices.append(float(price))
+                    yield f"{name} {description} {category_name}"
+            
+            # Use TF-IDF for text features, kept sparse
             tfidf = TfidfVectorizer(max_features=100, stop_words='english')
-            content_matrix = tfidf.fit_transform(descriptions).toarray()
+            content_matrix = tfidf.fit_transform(descriptions())
             
             # Normalize price features
-            prices = np.array([float(p.price) for p in products]).reshape(-1, 1)
             scaler = StandardScaler()
-            normalized_prices = scaler.fit_transform(prices)
+            normalized_prices = scaler.fit_transform(np.array(prices).reshape(-1, 1))
             
             # Combine features
-            content_features = np.hstack([content_matrix, normalized_prices])
+            content_features = sparse.hstack(
+                [content_matrix, sparse.csr_matrix(normalized_prices)], format='csr'
+            )
+            
+            self._save_content_features(cache_path, content_features)
             
             return content_features
             
@@ -134,6 +203,18 @@ class RecommendationService:
             logger.error(f"Error preparing content features: {str(e)}")
             return None
     
+    def _save_content_features(self, cache_path, content_features):
+        """
+        Persist fitted content features, replacing older catalog snapshots
+        """
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            for stale in cache_path.parent.glob('content_*.npz'):
+                stale.unlink()
+            sparse.save_npz(cache_path, content_features)
+        except OSError as e:
+            logger.warning(f"Could not cache content features: {str(e)}")
+    
     def train_model(self):
         """
         Train the recommendation model using collaborative filtering
@@ -142,23 +223,45 @@ class RecommendationService:
             logger.info("Training recommendation model...")
             
             # Prepare interaction data
-            self.user_item_matrix = self.prepare_interaction_data()
+            interaction_data = self.prepare_interaction_data()
             
-            if self.user_item_matrix is None:
+            if interaction_data is None:
                 logger.warning("No interaction data available for training")
                 return False
+            user_item_matrix, user_mapping, item_mapping = interaction_data
             
             # Compute similarity matrices using Cython-optimized functions
             logger.info("Computing user similarity matrix...")
-            self.user_similarity_matrix = compute_cosine_similarity_matrix(self.user_item_matrix)
+            user_sim = compute_cosine_similarity_matrix(user_item_matrix)
             
             logger.info("Computing item similarity matrix...")
-            self.item_similarity_matrix = compute_item_similarity_matrix(self.user_item_matrix)
-            
-            # Prepare content features
-            self.content_features = self.prepare_content_features()
+            item_sim = compute_item_similarity_matrix(user_item_matrix)
+            if settings.RECOMMENDATION_QUANTIZE_SIMILARITIES:
+                # Cosine scores lie in [-1, 1]; int8 keeps a quarter of the memory
+                item_sim = np.round(item_sim * SIMILARITY_SCALE).astype(np.int8)
+            
+            # Keep the norms around for incremental updates
+            squared = user_item_matrix.multiply(user_item_matrix)
+            user_norms = np.sqrt(np.asarray(squared.sum(axis=1), dtype=np.float64).ravel())
+            item_norms = np.sqrt(np.asarray(squared.sum(axis=0), dtype=np.float64).ravel())
+            
+            snapshot = _Snapshot(
+                user_item_matrix=user_item_matrix,
+                user_sim=user_sim,
+                item_sim=item_sim,
+                user_mapping=user_mapping,
+                item_mapping=item_mapping,
+                reverse_user_mapping={idx: user for user, idx in user_mapping.items()},
+                reverse_item_mapping={idx: item for item, idx in item_mapping.items()},
+                user_norms=user_norms,
+                item_norms=item_norms,
+                # Prepare content features
+                content_features=self.prepare_content_features(),
+            )
             
-            self.is_trained = True
+            # Publish the new model in a single assignment
+            with self._update_lock:
+                self._snapshot = snapshot
             logger.info("Model training completed successfully")
             return True
             
@@ -166,80 +269,214 @@ class RecommendationService:
             logger.error(f"Error training model: {str(e)}")
             return False
     
-    def get_user_recommendations(self, session_key, n_recommendations=5):
+    def _update_norms_incremental(self, user_norms, item_norms, user_idx, item_idx,
+                                  old_weight, new_weight):
+        """
+        Patch the cached user and item norms after one weight changes
+        """
+        delta = new_weight ** 2 - old_weight ** 2
+        user_norms[user_idx] = np.sqrt(max(0.0, user_norms[user_idx] ** 2 + delta))
+        item_norms[item_idx] = np.sqrt(max(0.0, item_norms[item_idx] ** 2 + delta))
+    
+    def _cosine_row(self, dots, norms, idx):
+        """
+        Turn the dot products of one row against all rows into cosine scores
+        """
+        denom = norms * norms[idx]
+        row = np.divide(dots, denom, out=np.zeros_like(denom), where=denom > 0)
+        row[idx] = 1.0
+        return row
+    
+    def update_interaction(self, session_key, product_id, delta):
         """
-        Get personalized recommendations for a user
+        Apply a weight change for one user-item pair to the trained model,
+        recomputing only the affected similarity rows instead of retraining.
+        Unknown users or products are left for the next full retrain
         """
         try:
-            if not self.is_trained:
-                self.train_model()
+            with self._update_lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    return False
+                
+                user_idx = snapshot.user_mapping.get(session_key)
+                item_idx = snapshot.item_mapping.get(product_id)
+                if user_idx is None or item_idx is None:
+                    return False
+                
+                matrix = snapshot.user_item_matrix
+                old_weight = float(matrix[user_idx, item_idx])
+                new_weight = old_weight + delta
+                matrix = (matrix + sparse.csr_matrix(
+                    ([delta], ([user_idx], [item_idx])), shape=matrix.shape, dtype=matrix.dtype
+                )).tocsr()
+                matrix.eliminate_zeros()
+                user_norms = snapshot.user_norms.copy()
+                item_norms = snapshot.item_norms.copy()
+                self._update_norms_incremental(
+                    user_norms, item_norms, user_idx, item_idx, old_weight, new_weight
+                )
+                
+                # The similarity matrices are too large to copy per
+                # interaction, so their rows are patched in place; shapes
+                # and mappings never change outside a retrain
+                user_dots = (matrix @ matrix.getrow(user_idx).T).toarray().ravel()
+                user_row = self._cosine_row(user_dots, user_norms, user_idx)
+                snapshot.user_sim[user_idx, :] = user_row
+                snapshot.user_sim[:, user_idx] = user_row
+                
+                item_dots = (matrix.T @ matrix.getcol(item_idx)).toarray().ravel()
+                item_row = self._cosine_row(item_dots, item_norms, item_idx)
+                if snapshot.item_sim.dtype == np.int8:
+                    item_row = np.round(item_row * SIMILARITY_SCALE).astype(np.int8)
+                snapshot.item_sim[item_idx, :] = item_row
+                snapshot.item_sim[:, item_idx] = item_row
+                
+                self._snapshot = replace(
+                    snapshot, user_item_matrix=matrix, user_norms=user_norms, item_norms=item_norms
+                )
+            
+            return True
             
-            if not self.is_trained or session_key not in self.user_mapping:
+        except Exception as e:
+            logger.error(f"Error updating interaction: {str(e)}")
+            return False
+    
+    def schedule_retrain(self):
+        """
+        Retrain the model in a background thread. Requests made while a
+        retrain is running are coalesced into a single follow-up run
+        """
+        with self._retrain_lock:
+            if self._retrain_running:
+                self._retrain_pending = True
+                return
+            self._retrain_running = True
+        
+        threading.Thread(
+            target=self._retrain_worker, name='recommendation-retrain', daemon=True
+        ).start()
+    
+    def _retrain_worker(self):
+        """
+        Run retrains until no further request is pending
+        """
+        try:
+            while True:
+                self.train_model()
+                with self._retrain_lock:
+                    if not self._retrain_pending:
+                        break
+                    self._retrain_pending = False
+        finally:
+            with self._retrain_lock:
+                self._retrain_running = False
+                self._retrain_pending = False
+            connection.close()
+    
+    def get_user_recommendations(self, session_key, n_recommendations=5):
+        """
+        Get personalized recommendations for a user as (product_id, score,
+        reason) tuples, best first. Loading the products is left to the
+        caller, which knows which columns it renders
+        """
+        try:
+            scored = self._scored_user_recommendations(session_key, n_recommendations)
+            if scored is None:
                 # Fallback to popular items for new users
                 return self._get_popular_recommendations(n_recommendations)
             
-            user_idx = self.user_mapping[session_key]
-            
-            # Get recommendations using Cython-optimized function
-            recommendations = compute_user_recommendations(
-                self.user_item_matrix,
-                self.user_similarity_matrix,
-                user_idx,
-                n_recommendations
-            )
-            
-            # Convert item indices back to product IDs
-            product_recommendations = []
-            for item_idx, score in recommendations:
-                product_id = self.reverse_item_mapping[item_idx]
-                try:
-                    product = Product.objects.get(id=product_id, is_active=True)
-                    product_recommendations.append({
-                        'product': product,
-                        'score': score,
-                        'reason': 'collaborative_filtering'
-                    })
-                except Product.DoesNotExist:
-                    continue
-            
-            return product_recommendations
+            return [
+                (product_id, score, 'collaborative_filtering')
+                for product_id, score in scored
+            ]
             
         except Exception as e:
             logger.error(f"Error getting user recommendations: {str(e)}")
             return self._get_popular_recommendations(n_recommendations)
     
+    def _recommendations_key(self, session_key):
+        return f'recs:{session_key}'
+    
+    def _scored_user_recommendations(self, session_key, n_recommendations):
+        """
+        Top (product_id, score) pairs for a session, served from the cache
+        when an earlier call asked for at least as many. Returns None for
+        sessions the model does not know
+        """
+        key = self._recommendations_key(session_key)
+        cached = cache.get(key)
+        if cached is not None and cached[0] >= n_recommendations:
+            return cached[1][:n_recommendations]
+        
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.train_model()
+            snapshot = self._snapshot
+        
+        if snapshot is None or session_key not in snapshot.user_mapping:
+            return None
+        
+        user_idx = snapshot.user_mapping[session_key]
+        
+        # Get recommendations using Cython-optimized function
+        recommendations = compute_user_recommendations(
+            snapshot.user_item_matrix,
+            snapshot.user_sim,
+            user_idx,
+            n_recommendations
+        )
+        scored = [
+            (snapshot.reverse_item_mapping[item_idx], score)
+            for item_idx, score in recommendations
+        ]
+        cache.set(key, (n_recommendations, scored), USER_RECOMMENDATIONS_TIMEOUT)
+        return scored
+    
     def get_similar_products(self, product_id, n_recommendations=5):
         """
         Get products similar to a given product
         """
         try:
-            if not self.is_trained:
+            snapshot = self._snapshot
+            if snapshot is None:
                 self.train_model()
+                snapshot = self._snapshot
             
-            if not self.is_trained or product_id not in self.item_mapping:
+            if snapshot is None or product_id not in snapshot.item_mapping:
                 return self._get_category_recommendations(product_id, n_recommendations)
             
-            item_idx = self.item_mapping[product_id]
+            item_idx = snapshot.item_mapping[product_id]
+            
+            # Get item similarities, excluding the item itself
+            similarities = snapshot.item_sim[item_idx, :].astype(np.float32)
+            if snapshot.item_sim.dtype == np.int8:
+                similarities /= SIMILARITY_SCALE
+            similarities[item_idx] = -np.inf
             
-            # Get item similarities
-            similarities = self.item_similarity_matrix[item_idx, :]
+            # Get top similar items; only the k survivors of the partition
+            # need sorting
+            k = min(n_recommendations, len(similarities) - 1)
+            if k > 0:
+                top = np.argpartition(-similarities, k - 1)[:k]
+                similar_indices = top[np.argsort(-similarities[top])]
+            else:
+                similar_indices = []
             
-            # Get top similar items
-            similar_indices = np.argsort(similarities)[::-1][1:n_recommendations+1]  # Exclude self
+            similar_indices = [idx for idx in similar_indices if similarities[idx] > 0]
+            product_ids = [snapshot.reverse_item_mapping[idx] for idx in similar_indices]
+            products = self._product_cards().in_bulk(product_ids)
             
             similar_products = []
-            for idx in similar_indices:
-                if similarities[idx] > 0:
-                    similar_product_id = self.reverse_item_mapping[idx]
-                    try:
-                        product = Product.objects.get(id=similar_product_id, is_active=True)
-                        similar_products.append({
-                            'product': product,
-                            'score': similarities[idx],
-                            'reason': 'item_similarity'
-                        })
-                    except Product.DoesNotExist:
-                        continue
+            for idx, product_id in zip(similar_indices, product_ids):
+                product = products.get(product_id)
+                if product is None:
+                    continue
+                similar_products.append({
+                    'product': product,
+                    'score': similarities[idx],
+                    'reason': 'item_similarity'
+                })
             
             return similar_products
             
@@ -247,20 +484,23 @@ class RecommendationService:
             logger.error(f"Error getting similar products: {str(e)}")
             return self._get_category_recommendations(product_id, n_recommendations)
     
+    def _product_cards(self):
+        """
+        Active products with only the columns recommendation cards render
+        """
+        return Product.objects.filter(is_active=True).only(*RECOMMENDATION_FIELDS)
+    
     def _get_popular_recommendations(self, n_recommendations=5):
         """
         Fallback recommendations based on popularity
         """
         try:
             # Get products with most positive interactions
-            popular_products = Product.objects.filter(
-                is_active=True
-            ).annotate(
+            popular_ids = Product.objects.filter(is_active=True).annotate(
                 interaction_count=models.Count('userinteraction')
-            ).order_by('-interaction_count')[:n_recommendations]
+            ).order_by('-interaction_count').values_list('id', flat=True)[:n_recommendations]
             
-            return [{'product': p, 'score': 1.0, 'reason': 'popularity'} 
-                   for p in popular_products]
+            return [(product_id, 1.0, 'popularity') for product_id in popular_ids]
                    
         except Exception as e:
             logger.error(f"Error getting popular recommendations: {str(e)}")
@@ -271,10 +511,9 @@ class RecommendationService:
         Fallback recommendations based on product category
         """
         try:
-            product = Product.objects.get(id=product_id)
-            similar_products = Product.objects.filter(
-                category=product.category,
-                is_active=True
+            product = Product.objects.only('category_id').get(id=product_id)
+            similar_products = self._product_cards().filter(
+                category_id=product.category_id
             ).exclude(id=product_id)[:n_recommendations]
             
             return [{'product': p, 'score': 1.0, 'reason': 'same_category'} 
@@ -284,6 +523,19 @@ class RecommendationService:
             logger.error(f"Error getting category recommendations: {str(e)}")
             return []
     
+    def _next_interaction_count(self, delta=1):
+        """
+        Bump the cached interaction count, seeding it from the table when
+        the key is missing or was evicted
+        """
+        try:
+            return cache.incr(INTERACTION_COUNT_KEY, delta)
+        except ValueError:
+            # The table already includes the interactions just created
+            count = UserInteraction.objects.count()
+            cache.add(INTERACTION_COUNT_KEY, count, timeout=None)
+            return count
+    
     def record_interaction(self, session_key, product_id, interaction_type):
         """
         Record a user interaction and update recommendations
@@ -296,17 +548,23 @@ class RecommendationService:
                 session_key=session_key,
                 product=product,
                 interaction_type=interaction_type,
-                defaults={'timestamp': models.timezone.now()}
+                defaults={'timestamp': timezone.now()}
             )
             
             if not created:
-                interaction.timestamp = models.timezone.now()
+                interaction.timestamp = timezone.now()
                 interaction.save()
-            
-            # Retrain model periodically (every 50 interactions)
-            interaction_count = UserInteraction.objects.count()
-            if interaction_count % 50 == 0:
-                self.train_model()
+            else:
+                weight = self._get_interaction_weight(interaction_type)
+                transaction.on_commit(
+                    lambda: self.update_interaction(session_key, product.id, weight)
+                )
+                transaction.on_commit(partial(cache.delete, self._recommendations_key(session_key)))
+                
+                # Retrain model periodically (every 50 interactions), off the
+                # request thread once the interaction is committed
+                if self._next_interaction_count() % 50 == 0:
+                    transaction.on_commit(self.schedule_retrain)
             
             return True
             
@@ -316,6 +574,89 @@ class RecommendationService:
         except Exception as e:
             logger.error(f"Error recording interaction: {str(e)}")
             return False
+    
+    def record_interactions(self, session_key, product_ids, interaction_type):
+        """
+        Record the same interaction type for several products, inserting
+        all new interactions with a single statement
+        """
+        try:
+            product_ids = list(dict.fromkeys(product_ids))
+            if not product_ids:
+                return True
+            
+            interactions = UserInteraction.objects.filter(
+                session_key=session_key, interaction_type=interaction_type
+            )
+            existing = set(
+                interactions.filter(product_id__in=product_ids).values_list('product_id', flat=True)
+            )
+            if existing:
+                interactions.filter(product_id__in=existing).update(timestamp=timezone.now())
+            
+            new_ids = [product_id for product_id in product_ids if product_id not in existing]
+            if not new_ids:
+                return True
+            
+            UserInteraction.objects.bulk_create([
+                UserInteraction(
+                    session_key=session_key,
+                    product_id=product_id,
+                    interaction_type=interaction_type
+                )
+                for product_id in new_ids
+            ], ignore_conflicts=True)
+            
+            weight = self._get_interaction_weight(interaction_type)
+            for product_id in new_ids:
+                transaction.on_commit(partial(self.update_interaction, session_key, product_id, weight))
+            transaction.on_commit(partial(cache.delete, self._recommendations_key(session_key)))
+            
+            # Retrain whenever the count passes a multiple of 50
+            count = self._next_interaction_count(len(new_ids))
+            if count // 50 != (count - len(new_ids)) // 50:
+                transaction.on_commit(self.schedule_retrain)
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error recording interactions: {str(e)}")
+            return False
+    
+    def queue_interaction(self, session_key, product_id, interaction_type):
+        """
+        Buffer an interaction for a background thread to write, so the
+        calling request does not wait on the database
+        """
+        with self._queue_lock:
+            self._interaction_queue.append((session_key, product_id, interaction_type))
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        
+        timer = threading.Timer(INTERACTION_FLUSH_INTERVAL, self._flush_interactions)
+        timer.name = 'interaction-flush'
+        timer.daemon = True
+        timer.start()
+    
+    def _flush_interactions(self):
+        """
+        Write the buffered interactions, one bulk insert per session and
+        interaction type
+        """
+        try:
+            with self._queue_lock:
+                queued = self._interaction_queue
+                self._interaction_queue = []
+                self._flush_scheduled = False
+            
+            groups = {}
+            for session_key, product_id, interaction_type in queued:
+                groups.setdefault((session_key, interaction_type), []).append(product_id)
+            for (session_key, interaction_type), product_ids in groups.items():
+                self.record_interactions(session_key, product_ids, interaction_type)
+        finally:
+            connection.close()
 
 # Global instance
 recommendation_service = RecommendationService()
\ No newline at end of file
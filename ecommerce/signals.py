@@ -0,0 +1,25 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, Product
+
+# Cache keys of the blocks shared by every visitor, filled by the views.
+# These receivers only see per-object saves and deletes; bulk_create and
+# queryset.update() send no signals, so bulk writers clear the keys themselves
+HOME_FEATURED_KEY = 'home:featured_v1'
+CATEGORIES_KEY = 'categories:all'
+# Product count of a listing, formatted with the category slug or 'all'
+PRODUCT_COUNT_KEY = 'product_count:{}'
+
+
+@receiver([post_save, post_delete], sender=Product)
+def clear_home_cache(sender, **kwargs):
+    """Drop the cached featured products when a product is saved or deleted"""
+    cache.delete(HOME_FEATURED_KEY)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def clear_category_cache(sender, **kwargs):
+    """Drop the cached category list when a category changes"""
+    cache.delete(CATEGORIES_KEY)
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+import numpy as np
+from scipy import sparse
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .models import CartItem, Category, Order, OrderItem, Product, UserInteraction
+from .recommendation_service import RecommendationService
+from .context_processors import CART_ITEMS_SESSION_KEY
+from .signals import CATEGORIES_KEY, HOME_FEATURED_KEY, PRODUCT_COUNT_KEY
+from .recommendation_engine import (
+    compute_cosine_similarity_matrix,
+    compute_item_similarity_matrix,
+    compute_user_recommendations,
+    fast_predict_rating,
+)
+
+
+def reference_cosine_similarity(matrix):
+    """Row-by-row cosine similarity, with zero rows scoring 0 and a unit diagonal"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n = matrix.shape[0]
+    norms = np.sqrt((matrix ** 2).sum(axis=1))
+    similarity = np.eye(n)
+    for i in range(n):
+        for j in range(i + 1, n):
+            if norms[i] > 0 and norms[j] > 0:
+                similarity[i, j] = similarity[j, i] = matrix[i] @ matrix[j] / (norms[i] * norms[j])
+    return similarity
+
+
+def reference_predict_rating(matrix, similarity, user_idx, item_idx, k=10):
+    """Weighted average rating of the k most similar users who rated the item"""
+    similar_users = [
+        (float(similarity[user_idx, i]), i, float(matrix[i, item_idx]))
+        for i in range(matrix.shape[0])
+        if i != user_idx and matrix[i, item_idx] > 0
+    ]
+    similar_users.sort(reverse=True)
+    positive = [(sim, rating) for sim, _, rating in similar_users[:k] if sim > 0]
+    similarity_sum = sum(sim for sim, _ in positive)
+    if similarity_sum > 0:
+        return sum(sim * rating for sim, rating in positive) / similarity_sum
+    return 0.0
+
+
+def reference_recommendations(matrix, similarity, user_idx, n_recommendations=5, k=10):
+    """Predict every unrated item one at a time and keep the best N"""
+    recommendations = []
+    for i in range(matrix.shape[1]):
+        if matrix[user_idx, i] == 0:
+            predicted = reference_predict_rating(matrix, similarity, user_idx, i, k)
+            if predicted > 0:
+                recommendations.append((i, predicted))
+    recommendations.sort(key=lambda x: x[1], reverse=True)
+    return recommendations[:n_recommendations]
+
+
+class RecommendationEngineTests(SimpleTestCase):
+    """The vectorized engine against straightforward loop implementations"""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        ratings = rng.choice([-1.0, 0.0, 0.0, 0.0, 1.0, 2.0, 3.0], size=(30, 20))
+        ratings *= rng.uniform(0.5, 1.5, size=ratings.shape)
+        ratings[5] = 0.0  # a user without interactions
+        ratings[:, 7] = 0.0  # an item nobody interacted with
+        self.dense = ratings.astype(np.float32)
+        self.inputs = {'dense': self.dense, 'csr': sparse.csr_matrix(self.dense)}
+
+        # Ties everywhere: users 1-3 are equally similar to user 0, and
+        # items 2 and 4 get the same prediction
+        self.tied = np.array([
+            [1, 0, 0, 0, 0],
+            [0, 1, 2, 0, 2],
+            [0, 2, 2, 1, 2],
+            [0, 3, 2, 1, 2],
+            [0, 0, 0, 4, 0],
+        ], dtype=np.float32)
+        self.tied_similarity = np.eye(5, dtype=np.float32)
+        self.tied_similarity[0, 1:] = [0.5, 0.5, 0.5, 0.25]
+
+    def test_user_similarity_matches_reference(self):
+        expected = reference_cosine_similarity(self.dense)
+        for name, matrix in self.inputs.items():
+            with self.subTest(input=name):
+                np.testing.assert_allclose(compute_cosine_similarity_matrix(matrix), expected, atol=1e-5)
+
+    def test_item_similarity_matches_reference(self):
+        expected = reference_cosine_similarity(self.dense.T)
+        for name, matrix in self.inputs.items():
+            with self.subTest(input=name):
+                np.testing.assert_allclose(compute_item_similarity_matrix(matrix), expected, atol=1e-5)
+
+    def test_predict_rating_matches_reference(self):
+        similarity = compute_cosine_similarity_matrix(self.dense)
+        for name, matrix in self.inputs.items():
+            for user_idx in range(0, 30, 4):
+                for item_idx in range(20):
+                    with self.subTest(input=name, user=user_idx, item=item_idx):
+                        self.assertAlmostEqual(
+                            fast_predict_rating(matrix, similarity, user_idx, item_idx, k=3),
+                            reference_predict_rating(self.dense, similarity, user_idx, item_idx, k=3),
+                            places=5
+                        )
+
+    def test_user_recommendations_match_reference(self):
+        similarity = compute_cosine_similarity_matrix(self.dense)
+        for name, matrix in self.inputs.items():
+            for user_idx in range(30):
+                with self.subTest(input=name, user=user_idx):
+                    recommendations = compute_user_recommendations(matrix, similarity, user_idx, 5, k=3)
+                    expected = reference_recommendations(self.dense, similarity, user_idx, 5, k=3)
+                    self.assertEqual([i for i, _ in recommendations], [i for i, _ in expected])
+                    np.testing.assert_allclose(
+                        [score for _, score in recommendations], [score for _, score in expected], rtol=1e-5
+                    )
+
+    def test_ties_keep_reference_order(self):
+        for matrix in (self.tied, sparse.csr_matrix(self.tied)):
+            with self.subTest(input=type(matrix).__name__):
+                # The two most similar raters of item 1 are users 3 and 2
+                self.assertEqual(fast_predict_rating(matrix, self.tied_similarity, 0, 1, k=2), 2.5)
+                # Items 2 and 4 tie, and the lower index wins the last slot
+                self.assertEqual(
+                    compute_user_recommendations(matrix, self.tied_similarity, 0, 2, k=2),
+                    [(1, 2.5), (2, 2.0)]
+                )
+
+
+class IncrementalUpdateTests(TestCase):
+    """Recording an interaction patches the model to what a retrain computes"""
+
+    def setUp(self):
+        cache.clear()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        category = Category.objects.create(name='Books', slug='books')
+        self.products = [
+            Product.objects.create(
+                name=f'Book {i}', slug=f'book-{i}', description=f'Volume {i} of the series',
+                price=10 + i, category=category, stock=5
+            )
+            for i in range(6)
+        ]
+        rng = np.random.default_rng(7)
+        types = ['view', 'like', 'purchase', 'dislike']
+        for s in range(8):
+            for product in rng.choice(self.products[:5], size=3, replace=False):
+                UserInteraction.objects.create(
+                    session_key=f'session-{s}', product=product, interaction_type=rng.choice(types)
+                )
+        # The last product is known to the model but has a single rater
+        UserInteraction.objects.create(
+            session_key='session-7', product=self.products[5], interaction_type='view'
+        )
+
+    def assert_matches_retrain(self, service):
+        retrained = RecommendationService()
+        self.assertTrue(retrained.train_model())
+        incremental, expected = service._snapshot, retrained._snapshot
+        np.testing.assert_allclose(
+            incremental.user_item_matrix.toarray(), expected.user_item_matrix.toarray()
+        )
+        np.testing.assert_allclose(incremental.user_norms, expected.user_norms, atol=1e-6)
+        np.testing.assert_allclose(incremental.item_norms, expected.item_norms, atol=1e-6)
+        np.testing.assert_allclose(incremental.user_sim, expected.user_sim, atol=1e-6)
+        self.assertEqual(incremental.item_sim.dtype, expected.item_sim.dtype)
+        if expected.item_sim.dtype == np.int8:
+            # Scores on a rounding boundary may land one step apart
+            np.testing.assert_allclose(incremental.item_sim, expected.item_sim, atol=1)
+        else:
+            np.testing.assert_allclose(incremental.item_sim, expected.item_sim, atol=1e-6)
+
+    def record_and_compare(self):
+        with override_settings(RECOMMENDATION_CACHE_DIR=self.cache_dir.name):
+            service = RecommendationService()
+            self.assertTrue(service.train_model())
+            viewed = UserInteraction.objects.filter(interaction_type='view').first()
+            unrated = next(
+                product for product in self.products
+                if not UserInteraction.objects.filter(session_key='session-0', product=product).exists()
+            )
+            # A new pair, and a dislike that turns an existing view negative
+            for session_key, product_id, interaction_type in (
+                ('session-0', unrated.id, 'like'),
+                (viewed.session_key, viewed.product_id, 'dislike'),
+            ):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertTrue(service.record_interaction(session_key, product_id, interaction_type))
+                self.assert_matches_retrain(service)
+
+    def test_update_matches_retrain(self):
+        self.record_and_compare()
+
+    @override_settings(RECOMMENDATION_QUANTIZE_SIMILARITIES=True)
+    def test_quantized_update_matches_retrain(self):
+        self.record_and_compare()
+
+
+class CatalogCacheTests(TestCase):
+    """Seeding the catalog shows up on pages that were cached before it"""
+
+    def setUp(self):
+        cache.clear()
+
+    def populate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('populate_data', stdout=StringIO())
+
+    def test_empty_catalog_is_not_cached(self):
+        self.client.get('/')
+        self.client.get('/products/')
+        self.populate()
+
+        response = self.client.get('/')
+        self.assertEqual(len(response.context['featured_products']), 8)
+        self.assertEqual(len(response.context['categories']), 6)
+        response = self.client.get('/products/')
+        self.assertEqual(response.context['page_obj'].paginator.count, Product.objects.count())
+
+    def test_populate_data_clears_cached_blocks(self):
+        self.populate()
+        self.client.get('/')
+        self.client.get('/products/')
+        self.client.get('/category/electronics/')
+        keys = [
+            CATEGORIES_KEY, HOME_FEATURED_KEY,
+            PRODUCT_COUNT_KEY.format('all'), PRODUCT_COUNT_KEY.format('electronics'),
+        ]
+        self.assertTrue(all(cache.get(key) for key in keys))
+
+        self.populate()
+        self.assertEqual(cache.get_many(keys), {})
+
+
+class AddToCartTests(TestCase):
+    """Adding to the cart never takes a line past the product's stock"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Atlas', slug='atlas', price=20, category=category, stock=3
+        )
+        self.inactive = Product.objects.create(
+            name='Almanac', slug='almanac', price=15, category=category, stock=10, is_active=False
+        )
+
+    def add(self, product, quantity):
+        return self.client.post(f'/cart/add/{product.id}/', {'quantity': quantity}).json()
+
+    def test_readding_stops_at_stock(self):
+        self.assertEqual(self.add(self.product, 2)['cart_items'], 2)
+        self.assertEqual(self.add(self.product, 1)['cart_items'], 3)
+
+        response = self.add(self.product, 1)
+        self.assertEqual(response, {'success': False, 'error': 'Not enough stock available'})
+        self.assertEqual(CartItem.objects.get(product=self.product).quantity, 3)
+
+    def test_first_add_past_stock_creates_no_line(self):
+        self.assertFalse(self.add(self.product, 4)['success'])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_inactive_product_is_not_added(self):
+        with self.assertLogs('ecommerce.views', 'ERROR'):
+            self.assertFalse(self.add(self.inactive, 1)['success'])
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CheckoutTests(TestCase):
+    """Placing an order is all or nothing"""
+
+    ORDER_FORM = {
+        'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+        'address': '12 Analytical Row', 'postal_code': '10001', 'city': 'London',
+    }
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Books', slug='books')
+        self.atlas = Product.objects.create(name='Atlas', slug='atlas', price=20, category=category, stock=5)
+        self.guide = Product.objects.create(name='Guide', slug='guide', price=12, category=category, stock=3)
+        self.client.post(f'/cart/add/{self.atlas.id}/', {'quantity': 2})
+        self.client.post(f'/cart/add/{self.guide.id}/', {'quantity': 3})
+
+    def test_checkout_places_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/checkout/', self.ORDER_FORM)
+
+        order = Order.objects.get()
+        self.assertRedirects(response, f'/order-success/{order.order_id}/')
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity')),
+            [(self.atlas.id, 2), (self.guide.id, 3)]
+        )
+        self.atlas.refresh_from_db()
+        self.guide.refresh_from_db()
+        self.assertEqual((self.atlas.stock, self.guide.stock), (3, 0))
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.session[CART_ITEMS_SESSION_KEY], 0)
+        self.assertEqual(UserInteraction.objects.filter(interaction_type='purchase').count(), 2)
+
+    def test_checkout_past_stock_rolls_back(self):
+        # Stock sold elsewhere after the items went into the cart
+        Product.objects.filter(pk=self.guide.pk).update(stock=1)
+
+        with self.assertLogs('ecommerce.views', 'ERROR'):
+            response = self.client.post('/checkout/', self.ORDER_FORM)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(
+            dict(Product.objects.values_list('slug', 'stock')), {'atlas': 5, 'guide': 1}
+        )
+        self.assertEqual(CartItem.objects.count(), 2)
@@ -1,51 +1,209 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse
 from django.views.decorators.http import require_POST, require_GET
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.contrib import messages
+from django.utils.functional import cached_property
+from django.core.cache import cache
 from django.core.paginator import Paginator
-from django.db.models import Q, Count
+from django.db import connection, transaction
+from django.db.models import Q, Count, Prefetch, Case, When, F, Sum, DecimalField
 import json
 import logging
+from decimal import Decimal
+from functools import partial
+
+import orjson
 
 from .models import Product, Category, Cart, CartItem, Order, OrderItem, UserInteraction
-from .recommendation_service import recommendation_service
+from .context_processors import CART_ITEMS_SESSION_KEY
+from .signals import CATEGORIES_KEY, HOME_FEATURED_KEY, PRODUCT_COUNT_KEY
+from .recommendation_service import RECOMMENDATION_FIELDS, recommendation_service
 
 logger = logging.getLogger(__name__)
 
-def get_or_create_cart(request):
-    """Get or create cart for session"""
+# Lifetime of the blocks shared by every visitor. Saves and deletes through
+# the models (the admin) clear them via signals; bulk writers such as
+# populate_data clear them explicitly
+HOME_CACHE_TIMEOUT = 300
+CATEGORIES_CACHE_TIMEOUT = 3600
+
+# Product columns rendered by the listing cards
+PRODUCT_LIST_FIELDS = (
+    'id', 'name', 'slug', 'description', 'price', 'stock', 'image_url', 'updated_at'
+)
+PRODUCT_COUNT_TIMEOUT = 60
+
+# Listing sort options, each backed by an (is_active, column) index
+PRODUCT_SORT_ORDERS = {
+    'price_asc': 'price',
+    'price_desc': '-price',
+    'name': 'name',
+}
+
+# Product columns returned by the recommendations JSON API
+RECOMMENDATION_API_FIELDS = ('id', 'name', 'slug', 'price', 'image_url')
+
+class OrjsonResponse(HttpResponse):
+    """JSON response encoded with orjson; Decimals are sent as strings"""
+    
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(
+            orjson.dumps(data, default=str, option=orjson.OPT_SERIALIZE_NUMPY),
+            **kwargs
+        )
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that keeps the total object count in the cache. A count of
+    zero is not cached, so a listing visited before seeding fills in
+    as soon as products exist
+    """
+    
+    def __init__(self, object_list, per_page, cache_key, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+    
+    @cached_property
+    def count(self):
+        count = cache.get(self.cache_key)
+        if count is None:
+            count = self.object_list.count()
+            if count:
+                cache.set(self.cache_key, count, PRODUCT_COUNT_TIMEOUT)
+        return count
+
+def get_or_create_cart(request, with_items=True, create=True):
+    """
+    Get or create cart for session. With with_items, the cart items are
+    prefetched together with their products and categories. Without
+    create, a visitor with no session gets None instead of a new session,
+    so only views that change the cart write a session row
+    """
     if not request.session.session_key:
+        if not create:
+            return None
         request.session.create()
     
-    cart, created = Cart.objects.get_or_create(
+    carts = Cart.objects.all()
+    if with_items:
+        carts = carts.prefetch_related(Prefetch(
+            'items',
+            queryset=CartItem.objects.select_related('product', 'product__category')
+        ))
+    cart, created = carts.get_or_create(
         session_key=request.session.session_key
     )
     return cart
 
+def all_categories():
+    """
+    Id, slug and name of every category, as rendered by the page sidebars.
+    An empty catalog is not cached, so seeding shows up right away
+    """
+    categories = cache.get(CATEGORIES_KEY)
+    if categories is None:
+        categories = list(Category.objects.values('id', 'slug', 'name'))
+        if categories:
+            cache.set(CATEGORIES_KEY, categories, CATEGORIES_CACHE_TIMEOUT)
+    return categories
+
+def load_json(body):
+    """
+    Parse a JSON request body with orjson, falling back to the stdlib
+    parser for input orjson rejects, such as NaN or invalid UTF-8
+    """
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return json.loads(body)
+
+def remember_cart_items(request, count):
+    """Keep the cart badge count in the session, writing only on change"""
+    if request.session.get(CART_ITEMS_SESSION_KEY, 0) != count:
+        request.session[CART_ITEMS_SESSION_KEY] = count
+
+def cart_totals(cart_id):
+    """Total cost and item count of a cart, aggregated in one query"""
+    totals = CartItem.objects.filter(cart_id=cart_id).aggregate(
+        total_cost=Sum(
+            F('quantity') * F('product__price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ),
+        total_items=Sum('quantity')
+    )
+    if totals['total_cost'] is None:
+        return 0, 0
+    return totals['total_cost'].quantize(Decimal('0.01')), totals['total_items']
+
+def load_recommendations(recommendations, fields=RECOMMENDATION_FIELDS):
+    """
+    Turn (product_id, score, reason) tuples from the recommendation service
+    into template-ready dicts, loading all products with one query
+    """
+    products = Product.objects.filter(is_active=True).only(*fields).in_bulk(
+        [product_id for product_id, _, _ in recommendations]
+    )
+    return [
+        {'product': products[product_id], 'score': score, 'reason': reason}
+        for product_id, score, reason in recommendations
+        if product_id in products
+    ]
+
+def increment_cart_item(cart, product_id, quantity):
+    """
+    Add quantity to an existing cart line in one UPDATE, only while the
+    product is active and its stock covers the new total. Returns the
+    number of updated lines
+    """
+    if connection.vendor == 'postgresql':
+        # A joined UPDATE re-checks the stock condition against the row it
+        # locked, so concurrent adds cannot push a line past the stock.
+        # The ORM would test it in a subquery on the statement's snapshot
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE ecommerce_cartitem ci SET quantity = ci.quantity + %s '
+                'FROM ecommerce_product p '
+                'WHERE ci.product_id = p.id AND ci.cart_id = %s AND ci.product_id = %s '
+                'AND p.is_active AND p.stock >= ci.quantity + %s',
+                [quantity, cart.id, product_id, quantity]
+            )
+            return cursor.rowcount
+    
+    # SQLite serializes writers, so the ORM form is safe there
+    return CartItem.objects.filter(
+        cart=cart,
+        product_id=product_id,
+        product__is_active=True,
+        product__stock__gte=F('quantity') + quantity
+    ).update(quantity=F('quantity') + quantity)
+
 @ensure_csrf_cookie
 def home(request):
     """Homepage with featured products and recommendations"""
     # Get featured products
-    featured_products = Product.objects.filter(
-        is_active=True
-    ).order_by('-created_at')[:8]
+    featured_products = cache.get(HOME_FEATURED_KEY)
+    if featured_products is None:
+        featured_products = list(Product.objects.filter(is_active=True).order_by('-created_at')[:8])
+        # Like the categories, an empty catalog is not cached
+        if featured_products:
+            cache.set(HOME_FEATURED_KEY, featured_products, HOME_CACHE_TIMEOUT)
     
     # Get categories
-    categories = Category.objects.all()[:6]
+    categories = all_categories()[:6]
     
     # Get personalized recommendations if session exists
     recommendations = []
     if request.session.session_key:
-        recommendations = recommendation_service.get_user_recommendations(
+        recommendations = load_recommendations(recommendation_service.get_user_recommendations(
             request.session.session_key, n_recommendations=4
-        )
+        ))
     
     context = {
         'featured_products': featured_products,
         'categories': categories,
-        'recommendations': recommendations,
-        'cart': get_or_create_cart(request)
+        'recommendations': recommendations
     }
     return render(request, 'ecommerce/home.html', context)
 
@@ -70,27 +228,27 @@ def product_list(request, category_slug=None):
     
     # Sorting
     sort_by = request.GET.get('sort', 'created_at')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:
-        products = products.order_by('-created_at')
+    products = products.order_by(PRODUCT_SORT_ORDERS.get(sort_by, '-created_at'))
     
-    # Pagination
-    paginator = Paginator(products, 12)
+    products = products.only(*PRODUCT_LIST_FIELDS)
+    
+    # Pagination; the count of a plain or category listing is shared by
+    # every visitor, so only search results are counted per request
+    if query:
+        paginator = Paginator(products, 12)
+    else:
+        paginator = CachedCountPaginator(
+            products, 12, cache_key=PRODUCT_COUNT_KEY.format(category_slug or 'all')
+        )
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
     context = {
         'page_obj': page_obj,
         'category': category,
-        'categories': Category.objects.all(),
+        'categories': all_categories(),
         'query': query,
-        'sort_by': sort_by,
-        'cart': get_or_create_cart(request)
+        'sort_by': sort_by
     }
     return render(request, 'ecommerce/product_list.html', context)
 
@@ -99,9 +257,9 @@ def product_detail(request, slug):
     """Display product details with recommendations"""
     product = get_object_or_404(Product, slug=slug, is_active=True)
     
-    # Record view interaction
+    # Record view interaction in the background
     if request.session.session_key:
-        recommendation_service.record_interaction(
+        recommendation_service.queue_interaction(
             request.session.session_key, 
             product.id, 
             'view'
@@ -114,8 +272,7 @@ def product_detail(request, slug):
     
     context = {
         'product': product,
-        'similar_products': similar_products,
-        'cart': get_or_create_cart(request)
+        'similar_products': similar_products
     }
     return render(request, 'ecommerce/product_detail.html', context)
 
@@ -123,54 +280,60 @@ def product_detail(request, slug):
 def add_to_cart(request, product_id):
     """Add product to cart via AJAX"""
     try:
-        product = get_object_or_404(Product, id=product_id, is_active=True)
-        cart = get_or_create_cart(request)
+        cart = get_or_create_cart(request, with_items=False)
         
         quantity = int(request.POST.get('quantity', 1))
         
-        # Check stock
-        if quantity > product.stock:
-            return JsonResponse({
-                'success': False, 
-                'error': 'Not enough stock available'
-            })
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            if cart_item.quantity > product.stock:
-                return JsonResponse({
+        # Products already in the cart take a single UPDATE
+        if not increment_cart_item(cart, product_id, quantity):
+            product = get_object_or_404(Product, id=product_id, is_active=True)
+            
+            # Check stock
+            if quantity > product.stock:
+                return OrjsonResponse({
+                    'success': False, 
+                    'error': 'Not enough stock available'
+                })
+            
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=cart,
+                product=product,
+                defaults={'quantity': quantity}
+            )
+            
+            # The line was there all along (out of stock for the new total)
+            # or was just added by a concurrent request
+            if not created and not increment_cart_item(cart, product_id, quantity):
+                return OrjsonResponse({
                     'success': False, 
                     'error': 'Not enough stock available'
                 })
-            cart_item.save()
         
-        return JsonResponse({
+        cart_total, cart_items = cart_totals(cart.id)
+        remember_cart_items(request, cart_items)
+        return OrjsonResponse({
             'success': True, 
-            'cart_total': cart.get_total_cost(),
-            'cart_items': cart.get_total_items()
+            'cart_total': cart_total,
+            'cart_items': cart_items
         })
         
     except Exception as e:
         logger.error(f"Error adding to cart: {str(e)}")
-        return JsonResponse({'success': False, 'error': 'Failed to add to cart'})
+        return OrjsonResponse({'success': False, 'error': 'Failed to add to cart'})
 
 @ensure_csrf_cookie
 def cart_detail(request):
     """Display cart contents"""
-    cart = get_or_create_cart(request)
+    cart = get_or_create_cart(request, create=False)
+    if cart is not None:
+        remember_cart_items(request, cart.get_total_items())
     
     # Get recommendations based on cart items
     recommendations = []
     if request.session.session_key:
-        recommendations = recommendation_service.get_user_recommendations(
+        recommendations = load_recommendations(recommendation_service.get_user_recommendations(
             request.session.session_key, n_recommendations=4
-        )
+        ))
     
     context = {
         'cart': cart,
@@ -182,93 +345,120 @@ def cart_detail(request):
 def update_cart(request, item_id):
     """Update cart item quantity"""
     try:
-        cart = get_or_create_cart(request)
-        cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
-        
+        cart = get_or_create_cart(request, with_items=False)
         quantity = int(request.POST.get('quantity', 1))
         
-        if quantity <= 0:
-            cart_item.delete()
-        else:
-            if quantity > cart_item.product.stock:
-                return JsonResponse({
-                    'success': False, 
-                    'error': 'Not enough stock available'
-                })
-            cart_item.quantity = quantity
-            cart_item.save()
+        # Lock the line so concurrent changes to it apply one at a time
+        with transaction.atomic():
+            cart_item = get_object_or_404(
+                CartItem.objects.select_for_update().select_related('product'),
+                id=item_id,
+                cart=cart
+            )
+            
+            if quantity <= 0:
+                cart_item.delete()
+            else:
+                if quantity > cart_item.product.stock:
+                    return OrjsonResponse({
+                        'success': False, 
+                        'error': 'Not enough stock available'
+                    })
+                cart_item.quantity = quantity
+                cart_item.save(update_fields=['quantity'])
         
-        return JsonResponse({
+        cart_total, cart_items = cart_totals(cart.id)
+        remember_cart_items(request, cart_items)
+        return OrjsonResponse({
             'success': True, 
-            'cart_total': cart.get_total_cost(),
-            'cart_items': cart.get_total_items()
+            'cart_total': cart_total,
+            'cart_items': cart_items
         })
         
     except Exception as e:
         logger.error(f"Error updating cart: {str(e)}")
-        return JsonResponse({'success': False, 'error': 'Failed to update cart'})
+        return OrjsonResponse({'success': False, 'error': 'Failed to update cart'})
 
 @require_POST
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
     try:
-        cart = get_or_create_cart(request)
-        cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
-        cart_item.delete()
+        cart = get_or_create_cart(request, with_items=False)
+        deleted, _ = CartItem.objects.filter(id=item_id, cart=cart).delete()
+        if not deleted:
+            return OrjsonResponse({'success': False, 'error': 'Failed to remove item'})
         
-        return JsonResponse({
+        cart_total, cart_items = cart_totals(cart.id)
+        remember_cart_items(request, cart_items)
+        return OrjsonResponse({
             'success': True, 
-            'cart_total': cart.get_total_cost(),
-            'cart_items': cart.get_total_items()
+            'cart_total': cart_total,
+            'cart_items': cart_items
         })
         
     except Exception as e:
         logger.error(f"Error removing from cart: {str(e)}")
-        return JsonResponse({'success': False, 'error': 'Failed to remove item'})
+        return OrjsonResponse({'success': False, 'error': 'Failed to remove item'})
 
 def checkout(request):
     """Checkout page"""
-    cart = get_or_create_cart(request)
+    cart = get_or_create_cart(request, create=False)
+    
+    # Evaluate the cart lines once; the checks, the order and the page
+    # all reuse this list
+    cart_items = list(cart.items.all()) if cart is not None else []
+    remember_cart_items(request, sum(cart_item.quantity for cart_item in cart_items))
     
-    if not cart.items.exists():
+    if not cart_items:
         messages.warning(request, 'Your cart is empty')
         return redirect('ecommerce:cart')
     
     if request.method == 'POST':
         try:
-            # Create order
-            order = Order.objects.create(
-                session_key=request.session.session_key,
-                first_name=request.POST.get('first_name'),
-                last_name=request.POST.get('last_name'),
-                email=request.POST.get('email'),
-                address=request.POST.get('address'),
-                postal_code=request.POST.get('postal_code'),
-                city=request.POST.get('city')
-            )
-            
-            # Create order items and record purchase interactions
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    price=cart_item.product.price,
-                    quantity=cart_item.quantity
+            with transaction.atomic():
+                # Create order
+                order = Order.objects.create(
+                    session_key=request.session.session_key,
+                    first_name=request.POST.get('first_name'),
+                    last_name=request.POST.get('last_name'),
+                    email=request.POST.get('email'),
+                    address=request.POST.get('address'),
+                    postal_code=request.POST.get('postal_code'),
+                    city=request.POST.get('city')
                 )
                 
-                # Record purchase interaction
-                recommendation_service.record_interaction(
+                # Create order items in one INSERT
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        product=cart_item.product,
+                        price=cart_item.product.price,
+                        quantity=cart_item.quantity
+                    )
+                    for cart_item in cart_items
+                ])
+                
+                # Record purchase interactions once the order is committed,
+                # so a failed recommendation write cannot abort the order
+                transaction.on_commit(partial(
+                    recommendation_service.record_interactions,
                     request.session.session_key,
-                    cart_item.product.id,
+                    [cart_item.product_id for cart_item in cart_items],
                     'purchase'
-                )
+                ))
                 
-                # Update stock
-                cart_item.product.stock -= cart_item.quantity
-                cart_item.product.save()
-            
-            # Clear cart
-            cart.items.all().delete()
+                # Update stock of all ordered products in one UPDATE; F()
+                # decrements the current row value rather than a stale copy
+                Product.objects.filter(
+                    pk__in=[cart_item.product_id for cart_item in cart_items]
+                ).update(stock=Case(*[
+                    When(pk=cart_item.product_id, then=F('stock') - cart_item.quantity)
+                    for cart_item in cart_items
+                ]))
+                
+                # Clear cart
+                cart.items.all().delete()
+                remember_cart_items(request, 0)
             
             messages.success(request, f'Order {order.order_id} placed successfully!')
             return redirect('ecommerce:order_success', order_id=order.order_id)
@@ -295,11 +485,11 @@ def product_interaction(request, product_id):
         if not request.session.session_key:
             request.session.create()
         
-        data = json.loads(request.body)
+        data = load_json(request.body)
         interaction_type = data.get('type')
         
         if interaction_type not in ['like', 'dislike']:
-            return JsonResponse({'success': False, 'error': 'Invalid interaction type'})
+            return OrjsonResponse({'success': False, 'error': 'Invalid interaction type'})
         
         success = recommendation_service.record_interaction(
             request.session.session_key,
@@ -308,24 +498,27 @@ def product_interaction(request, product_id):
         )
         
         if success:
-            return JsonResponse({'success': True})
+            return OrjsonResponse({'success': True})
         else:
-            return JsonResponse({'success': False, 'error': 'Failed to record interaction'})
+            return OrjsonResponse({'success': False, 'error': 'Failed to record interaction'})
             
     except Exception as e:
         logger.error(f"Error recording interaction: {str(e)}")
-        return JsonResponse({'success': False, 'error': 'Server error'})
+        return OrjsonResponse({'success': False, 'error': 'Server error'})
 
 @require_GET
 def get_recommendations(request):
     """Get personalized recommendations via AJAX"""
     try:
         if not request.session.session_key:
-            return JsonResponse({'recommendations': []})
+            return OrjsonResponse({'recommendations': []})
         
-        recommendations = recommendation_service.get_user_recommendations(
-            request.session.session_key, 
-            n_recommendations=int(request.GET.get('count', 5))
+        recommendations = load_recommendations(
+            recommendation_service.get_user_recommendations(
+                request.session.session_key,
+                n_recommendations=int(request.GET.get('count', 5))
+            ),
+            fields=RECOMMENDATION_API_FIELDS
         )
         
         rec_data = []
@@ -340,8 +533,8 @@ def get_recommendations(request):
                 'reason': rec['reason']
             })
         
-        return JsonResponse({'recommendations': rec_data})
+        return OrjsonResponse({'recommendations': rec_data})
         
     except Exception as e:
         logger.error(f"Error getting recommendations: {str(e)}")
-        return JsonResponse({'recommendations': []})
+        return OrjsonResponse({'recommendations': []})
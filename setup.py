@@ -1,15 +1,34 @@
+import os
+import sys
+
 from setuptools import setup, Extension, find_packages
 from Cython.Build import cythonize
 import numpy
 
+# The default build runs on any machine of the target architecture. Set
+# ECOMMERCE_NATIVE_BUILD=1 to tune for the build host's CPU instead (AVX2,
+# FMA, ...); such binaries are not redistributable
+NATIVE_BUILD = os.environ.get("ECOMMERCE_NATIVE_BUILD") == "1"
+
+compile_args = ["-O3", "-ffast-math"]
+link_args = ["-O3"]
+if NATIVE_BUILD:
+    compile_args.append("-march=native")
+
+# OpenMP parallelizes the similarity kernels; Apple's clang ships without it
+if sys.platform != "darwin":
+    compile_args.append("-fopenmp")
+    link_args.append("-fopenmp")
+
 # Define the Cython extension
 extensions = [
     Extension(
         "ecommerce.recommendation_engine",
         ["ecommerce/recommendation_engine.pyx"],
         include_dirs=[numpy.get_include()],
-        extra_compile_args=["-O3", "-ffast-math"],
-        extra_link_args=["-O3"]
+        define_macros=[("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION")],
+        extra_compile_args=compile_args,
+        extra_link_args=link_args
     )
 ]
 
@@ -18,4 +37,4 @@ setup(
     packages=['ecommerce'],
     ext_modules=cythonize(extensions, compiler_directives={'language_level': 3}),
     zip_safe=False,
-)
\ No newline at end of file
+)